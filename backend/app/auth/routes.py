@@ -1,4 +1,5 @@
 # backend/app/auth/routes.py
+from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
@@ -12,6 +13,7 @@ from app.logger import logger
 auth_router = APIRouter(prefix="/auth", tags=["auth"])
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login", auto_error=False)
 
 async def get_current_user(
     token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
@@ -33,6 +35,14 @@ async def get_current_user(
         logger.error(f"JWT error: {str(e)}")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials")
 
+async def get_optional_user(
+    token: Optional[str] = Depends(optional_oauth2_scheme), db: AsyncSession = Depends(get_db)
+) -> Optional[models.User]:
+    """Like get_current_user, but returns None for anonymous requests."""
+    if token is None:
+        return None
+    return await get_current_user(token, db)
+
 @auth_router.post("/signup", response_model=schemas.UserResponse)
 async def signup(user_data: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(models.User).filter(models.User.email == user_data.email))
@@ -28,3 +28,10 @@ PRIVATE_FINAL_BUCKET = os.getenv("PRIVATE_FINAL_BUCKET", "private-final-instrume
 
 # Spleeter Service URL
 SPLEETER_SERVICE_URL = os.getenv("SPLEETER_SERVICE_URL", "http://spleeter:5001/separate")
+
+# Model used for the fast preview pass of progressive uploads
+PREVIEW_MODEL = os.getenv("PREVIEW_MODEL", "2stems")
+
+# Request timeouts (seconds) for separations the client waits for, and for queued full-quality passes
+SEPARATION_TIMEOUT = float(os.getenv("SEPARATION_TIMEOUT", "180"))
+FULL_SEPARATION_TIMEOUT = float(os.getenv("FULL_SEPARATION_TIMEOUT", "3600"))
@@ -1,4 +1,5 @@
 import logging
+from app.tracing import TraceContextFilter
 
 # Create a logger for the instrumental_pipeline application
 logger = logging.getLogger("instrumental_pipeline")
@@ -8,9 +9,10 @@ logger.setLevel(logging.INFO)  # Set to INFO or DEBUG as needed
 stream_handler = logging.StreamHandler()
 stream_handler.setLevel(logging.INFO)
 
-# Create a formatter and set it for the handler
-formatter = logging.Formatter("%(asctime)s [%(levelname)-5.5s] %(name)s: %(message)s")
+# Create a formatter and set it for the handler, tagging each record with the current trace id
+formatter = logging.Formatter("%(asctime)s [%(levelname)-5.5s] [trace=%(trace_id)s] %(name)s: %(message)s")
 stream_handler.setFormatter(formatter)
+stream_handler.addFilter(TraceContextFilter())
 
 # Add the handler if not already present
 if not logger.handlers:
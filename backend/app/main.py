@@ -1,12 +1,14 @@
 import os
+import re
 import json
 import asyncio
 import urllib.parse
 from io import BytesIO
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Query, Request
+from typing import Optional
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from minio import Minio
 import redis
 import httpx
 
@@ -18,22 +20,25 @@ from alembic.config import Config
 from alembic import command
 
 # Import application modules
-from app.auth.routes import get_current_user, auth_router
+from app.auth.routes import get_current_user, get_optional_user, auth_router
 from app.database import engine, Base, get_db, SessionLocal
 from app import models
 from app.models import Song, User
+from app.schemas import UploadCheckRequest, UploadCheckResponse, UploadCheckResult
 from app.routes.song_router import song_router
 from app.admin.routes import admin_router
 from app.config import (
-    MINIO_ENDPOINT,
-    MINIO_ACCESS_KEY,
-    MINIO_SECRET_KEY,
     PUBLIC_ORIGINAL_BUCKET,
     PRIVATE_ORIGINAL_BUCKET,
-    SPLEETER_SERVICE_URL
+    SPLEETER_SERVICE_URL,
+    PREVIEW_MODEL,
+    SEPARATION_TIMEOUT,
+    FULL_SEPARATION_TIMEOUT
 )
-from app.utils.common import to_snake_case, generate_task_id
+from app.utils.common import to_snake_case, generate_task_id, file_hash
+from app.utils.storage import minio_client
 from app.logger import logger
+from app.tracing import TRACEPARENT_HEADER, start_span, inject_headers, current_trace_id, current_span
 from app.auth.utils import hash_password
 
 app = FastAPI()
@@ -72,6 +77,13 @@ async def on_startup():
         else:
             logger.info("Default admin already exists.")
 
+    # Every worker drains the shared queue of full-quality passes
+    app.state.full_separation_worker = asyncio.create_task(process_full_separations())
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    app.state.full_separation_worker.cancel()
+
 # Include routers
 app.include_router(admin_router)
 app.include_router(song_router)
@@ -86,13 +98,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize MinIO client with environment variables
-minio_client = Minio(
-    MINIO_ENDPOINT.replace("http://", ""),
-    access_key=MINIO_ACCESS_KEY,
-    secret_key=MINIO_SECRET_KEY,
-    secure=False
-)
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # Continue the caller's trace (e.g. from the file watcher) or start a new one at ingest
+    with start_span(
+        f"{request.method} {request.url.path}",
+        traceparent=request.headers.get(TRACEPARENT_HEADER),
+        http_method=request.method,
+        http_path=request.url.path
+    ) as span:
+        response = await call_next(request)
+        span.set_tag("http_status_code", response.status_code)
+        response.headers[TRACEPARENT_HEADER] = span.traceparent
+        return response
 
 REDIS_HOST = os.getenv("REDIS_HOST", "redis")
 REDIS_PORT = os.getenv("REDIS_PORT", "6379")
@@ -110,62 +128,388 @@ def create_buckets():
 def read_root():
     return {"message": "Welcome to the Instrumental Pipeline API"}
 
+# Header the Spleeter service uses to report the stage a failed job stopped at
+PIPELINE_STAGE_HEADER = "X-Pipeline-Stage"
+
+async def set_song_status(task_id: str, status: str) -> None:
+    """Record the processing status of a song in the database and in Redis."""
+    with start_span("db.update_song_status", task_id=task_id, status=status):
+        async with SessionLocal() as db:
+            result = await db.execute(select(Song).filter(Song.task_id == task_id))
+            song = result.scalars().first()
+            if song:
+                song.processing_status = status
+                await db.commit()
+    with start_span("redis.hset", task_id=task_id):
+        redis_client.hset(task_id, mapping={"status": status})
+
+# How often the backend mirrors the stage published by the Spleeter service into the song
+STAGE_POLL_INTERVAL = 2.0
+
+async def follow_pipeline_stage(task_id: str, request: asyncio.Task, status_prefix: str = "Processing") -> None:
+    """
+    Reflect the stage the Spleeter service publishes in Redis into the song's status
+    (as "<status_prefix>: <stage>") until the request ends.
+    """
+    last_stage = None
+    while not request.done():
+        try:
+            stage = await run_in_threadpool(redis_client.hget, task_id, "stage")
+        except redis.RedisError:
+            stage = None  # the stage is informational; keep waiting for the request
+        if stage and stage != last_stage:
+            last_stage = stage
+            await set_song_status(task_id, f"{status_prefix}: {stage}")
+        await asyncio.wait([request], timeout=STAGE_POLL_INTERVAL)
+
+async def trigger_separation(task_id: str, model: str, source: str, preview: bool = False,
+                             timeout: float = SEPARATION_TIMEOUT, status_prefix: str = "Processing") -> None:
+    """
+    Call the Spleeter service, recording the failing stage on the song if it errors.
+    status_prefix is the status shown with the live stage; a full pass after a
+    preview keeps "Previewable" so the provisional result stays advertised.
+    """
+    redis_client.hdel(task_id, "stage")
+    try:
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            with start_span("spleeter.separate", task_id=task_id, model=model, preview=preview) as span:
+                request = asyncio.create_task(client.post(
+                    SPLEETER_SERVICE_URL,
+                    params={"file_name": task_id, "model": model, "source": source, "preview": str(preview).lower()},
+                    headers=inject_headers(),
+                ))
+                await follow_pipeline_stage(task_id, request, status_prefix)
+                response = await request
+                span.set_tag("http_status_code", response.status_code)
+    except Exception:
+        # Timed out or unreachable: the last published stage is the best guess at where it stopped
+        await set_song_status(task_id, f"Failed: {redis_client.hget(task_id, 'stage') or 'request'}")
+        raise
+    if response.is_error:
+        stage = response.headers.get(PIPELINE_STAGE_HEADER) or "unknown"
+        await set_song_status(task_id, f"Failed: {stage}")
+    response.raise_for_status()
+
+# Full-quality passes of progressive uploads are queued in Redis so they survive a backend restart.
+# A claimed job moves to the processing list and holds a lease that its worker keeps renewing;
+# jobs whose lease lapsed (their worker died) are put back at the front of the queue.
+# The task ids of queued and running jobs are kept in a set so a task is never queued twice.
+FULL_SEPARATION_QUEUE = "separation:full"
+FULL_SEPARATION_PROCESSING = "separation:full:processing"
+FULL_SEPARATION_TASKS = "separation:full:tasks"
+FULL_SEPARATION_LEASE_PREFIX = "separation:full:lease:"
+FULL_SEPARATION_LEASE = 60
+FULL_SEPARATION_POLL_INTERVAL = 2.0
+
+push_full_separation = redis_client.register_script("""
+if redis.call("SADD", KEYS[2], ARGV[1]) == 0 then
+    return 0
+end
+redis.call("LPUSH", KEYS[1], ARGV[2])
+return 1
+""")
+
+claim_full_separation = redis_client.register_script("""
+local job = redis.call("RPOPLPUSH", KEYS[1], KEYS[2])
+if job then
+    redis.call("SET", ARGV[1] .. job, "1", "EX", ARGV[2])
+end
+return job
+""")
+
+requeue_expired_full_separations = redis_client.register_script("""
+local requeued = 0
+for _, job in ipairs(redis.call("LRANGE", KEYS[2], 0, -1)) do
+    if redis.call("EXISTS", ARGV[1] .. job) == 0 then
+        redis.call("LREM", KEYS[2], 1, job)
+        redis.call("RPUSH", KEYS[1], job)
+        requeued = requeued + 1
+    end
+end
+return requeued
+""")
+
+def enqueue_full_separation(task_id: str, model: str, source: str, traceparent: Optional[str]) -> bool:
+    """Queue a full-quality pass; returns False if one is already queued or running for the task."""
+    job = json.dumps({"task_id": task_id, "model": model, "source": source, "traceparent": traceparent})
+    return bool(push_full_separation(keys=[FULL_SEPARATION_QUEUE, FULL_SEPARATION_TASKS], args=[task_id, job]))
+
+def is_full_separation_pending(task_id: str) -> bool:
+    return bool(redis_client.sismember(FULL_SEPARATION_TASKS, task_id))
+
+async def renew_lease(job: str) -> None:
+    while True:
+        await asyncio.sleep(FULL_SEPARATION_LEASE / 3)
+        try:
+            if not redis_client.expire(FULL_SEPARATION_LEASE_PREFIX + job, FULL_SEPARATION_LEASE):
+                logger.warning(f"⚠️ Lease of full-quality job {job} lapsed; it may be run again")
+        except redis.RedisError as e:
+            logger.warning(f"⚠️ Could not renew the lease of full-quality job {job}: {str(e)}")
+
+def release_full_separation(job: str, requeue: bool = False) -> None:
+    """Remove a claimed job from the processing list, either finishing it or handing it back to the queue."""
+    try:
+        pipe = redis_client.pipeline()
+        pipe.lrem(FULL_SEPARATION_PROCESSING, 1, job)
+        if requeue:
+            pipe.rpush(FULL_SEPARATION_QUEUE, job)
+        else:
+            try:
+                pipe.srem(FULL_SEPARATION_TASKS, json.loads(job)["task_id"])
+            except (ValueError, KeyError, TypeError):
+                pass  # malformed job, it was never registered
+        pipe.delete(FULL_SEPARATION_LEASE_PREFIX + job)
+        pipe.execute()
+    except redis.RedisError as e:
+        # The lease lapses on its own and the job is requeued by the next sweep
+        logger.error(f"❌ Could not release full-quality job {job}: {str(e)}")
+
+async def run_full_separation(task_id: str, model: str, source: str, traceparent: Optional[str]) -> None:
+    """Full-quality pass run after a preview; it replaces the provisional instrumental when done."""
+    with start_span("separation.full", traceparent=traceparent, task_id=task_id, model=model):
+        try:
+            await trigger_separation(
+                task_id, model, source, timeout=FULL_SEPARATION_TIMEOUT, status_prefix="Previewable"
+            )
+        except Exception as e:
+            logger.error(f"❌ Full-quality processing failed for {task_id}: {str(e)}")
+            return
+        await set_song_status(task_id, "Completed")
+        logger.info(f"✅ Full-quality processing finished for {task_id}")
+
+async def process_full_separations() -> None:
+    """Run queued full-quality passes one at a time, recovering jobs left behind by dead workers."""
+    keys = [FULL_SEPARATION_QUEUE, FULL_SEPARATION_PROCESSING]
+    while True:
+        try:
+            requeued = requeue_expired_full_separations(keys=keys, args=[FULL_SEPARATION_LEASE_PREFIX])
+            if requeued:
+                logger.info(f"🔁 Requeued {requeued} interrupted full-quality pass(es)")
+            job = claim_full_separation(keys=keys, args=[FULL_SEPARATION_LEASE_PREFIX, FULL_SEPARATION_LEASE])
+        except redis.RedisError as e:
+            logger.error(f"❌ Could not read the full-quality queue: {str(e)}")
+            job = None
+        if job is None:
+            await asyncio.sleep(FULL_SEPARATION_POLL_INTERVAL)
+            continue
+
+        renewer = asyncio.create_task(renew_lease(job))
+        try:
+            params = json.loads(job)
+            await run_full_separation(params["task_id"], params["model"], params["source"], params.get("traceparent"))
+        except asyncio.CancelledError:
+            # Shutting down: hand the job straight back instead of waiting for the lease to lapse
+            release_full_separation(job, requeue=True)
+            raise
+        except Exception as e:
+            logger.error(f"❌ Full-quality job {job} could not be run: {str(e)}")
+        finally:
+            renewer.cancel()
+        release_full_separation(job)
+
+MD5_HEX_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+def is_known_status(status: str, source: str = "") -> bool:
+    """
+    Whether content with this status needs no new upload. Only finished songs count:
+    in-flight or failed rows may never complete, and re-uploading them resumes the job.
+    Manual clients may also stop at a preview ("Previewable" or "Previewable: <stage>"),
+    since its full pass is queued before the preview is announced.
+    """
+    if status == "Completed":
+        return True
+    return source.lower() == "manual" and (status == "Previewable" or status.startswith("Previewable:"))
+
+async def find_songs_by_content(pairs: list, is_global: bool, user_id: Optional[int] = None) -> dict:
+    """
+    Map (content_hash, file_size) pairs to the songs of the given visibility already holding that content.
+    Private songs only match for their owner, so without a user_id nothing private is found.
+    """
+    hashes = {content_hash for content_hash, _ in pairs}
+    if not hashes or (not is_global and user_id is None):
+        return {}
+    query = select(Song).filter(Song.content_hash.in_(hashes), Song.is_global == is_global)
+    if not is_global:
+        query = query.filter(Song.user_id == user_id)
+    with start_span("db.find_songs_by_content", count=len(hashes)):
+        async with SessionLocal() as db:
+            result = await db.execute(query)
+            songs = result.scalars().all()
+    found = {}
+    for song in songs:
+        key = (song.content_hash, song.file_size)
+        # Prefer a finished song when the same content was uploaded twice
+        if key not in found or found[key].processing_status != "Completed":
+            found[key] = song
+    return found
+
+@app.head("/upload/check")
+async def check_upload_head(
+    content_hash: str = Query(..., alias="hash", description="MD5 hex digest of the file contents"),
+    size: int = Query(..., ge=0, description="File size in bytes"),
+    source: str = Query("", description="Source of file: 'manual' for user uploads, empty for auto downloads"),
+    current_user: Optional[User] = Depends(get_optional_user)
+):
+    """
+    Returns 200 if the content is already known and does not need uploading, 404 otherwise.
+    Checking manual uploads requires a signed-in user and only matches their own songs.
+    """
+    content_hash = content_hash.lower()
+    if not MD5_HEX_PATTERN.match(content_hash):
+        return Response(status_code=400)
+    is_global = source.lower() != "manual"
+    if not is_global and current_user is None:
+        return Response(status_code=401)
+    user_id = current_user.id if current_user else None
+    song = (await find_songs_by_content([(content_hash, size)], is_global, user_id)).get((content_hash, size))
+    if song and is_known_status(song.processing_status, source):
+        return Response(status_code=200, headers={"X-Task-Id": song.task_id})
+    return Response(status_code=404)
+
+@app.post("/upload/check", response_model=UploadCheckResponse)
+async def check_upload(
+    payload: UploadCheckRequest,
+    source: str = Query("", description="Source of file: 'manual' for user uploads, empty for auto downloads"),
+    current_user: Optional[User] = Depends(get_optional_user)
+):
+    """
+    Checks many (hash, size) pairs at once so clients only upload content the pipeline has not finished.
+    Only songs of the same visibility as source count; unfinished or failed content is reported
+    as unknown so it is uploaded again. Checking manual uploads requires a signed-in user and
+    only matches (and reports task ids for) their own songs.
+    """
+    is_global = source.lower() != "manual"
+    if not is_global and current_user is None:
+        raise HTTPException(status_code=401, detail="Sign in to check manual uploads")
+    pairs = [(item.hash.lower(), item.size) for item in payload.files]
+    for content_hash, _ in pairs:
+        if not MD5_HEX_PATTERN.match(content_hash):
+            raise HTTPException(status_code=400, detail=f"Invalid MD5 hash: {content_hash}")
+    found = await find_songs_by_content(pairs, is_global, current_user.id if current_user else None)
+    results = []
+    for content_hash, size in pairs:
+        song = found.get((content_hash, size))
+        results.append(UploadCheckResult(
+            hash=content_hash,
+            size=size,
+            known=bool(song and is_known_status(song.processing_status, source)),
+            task_id=song.task_id if song else None,
+            processing_status=song.processing_status if song else None
+        ))
+    return UploadCheckResponse(results=results)
+
 @app.post("/upload/")
 async def upload_file(
     request: Request,
     file: UploadFile = File(...),
+    current_user: Optional[User] = Depends(get_optional_user),
     model: str = Query("5stems"),
-    source: str = Query("", description="Source of file: 'manual' for user uploads, empty for auto downloads")
+    source: str = Query("", description="Source of file: 'manual' for user uploads, empty for auto downloads"),
+    progressive: Optional[bool] = Query(
+        None,
+        description="Return after a fast preview pass and finish the full model in the background "
+                    "(defaults to on for manual uploads)"
+    )
 ):
+    if progressive is None:
+        progressive = source.lower() == "manual"
+    progressive = progressive and model != PREVIEW_MODEL
+    task_id = file.filename
     try:
-        file_data = await file.read()
-        task_id = generate_task_id(file.filename, file_data)
+        with start_span("upload.read", filename=file.filename):
+            file_data = await file.read()
+            task_id = generate_task_id(file.filename, file_data)
+            content_hash = file_hash(file_data)
 
-        async with SessionLocal() as db:
-            result = await db.execute(select(Song).filter(Song.task_id == task_id))
-            existing_song = result.scalars().first()
-            if existing_song:
+        with start_span("db.find_song", task_id=task_id):
+            async with SessionLocal() as db:
+                result = await db.execute(select(Song).filter(Song.task_id == task_id))
+                existing_song = result.scalars().first()
+            if existing_song and existing_song.processing_status == "Completed":
                 raise HTTPException(status_code=400, detail="Duplicate file upload detected.")
+            if not existing_song:
+                # Same content under a different filename
+                is_global = source.lower() != "manual"
+                user_id = current_user.id if current_user else None
+                same_content = (await find_songs_by_content([(content_hash, len(file_data))], is_global, user_id)).get(
+                    (content_hash, len(file_data))
+                )
+                if same_content and same_content.processing_status == "Completed":
+                    raise HTTPException(status_code=400, detail="Duplicate file upload detected.")
 
-        bucket = PRIVATE_ORIGINAL_BUCKET if source.lower() == "manual" else PUBLIC_ORIGINAL_BUCKET
-        file_length = len(file_data)
-        file_stream = BytesIO(file_data)
-        minio_client.put_object(
-            bucket,
-            task_id,
-            data=file_stream,
-            length=file_length,
-            part_size=10 * 1024 * 1024
-        )
-        logger.info(f"✅ Original file uploaded: {task_id} to bucket: {bucket}")
-
-        redis_client.hset(task_id, mapping={"status": "Uploaded", "progress": "0%"})
-
-        async with httpx.AsyncClient(timeout=180) as client:
-            response = await client.post(
-                SPLEETER_SERVICE_URL,
-                params={"file_name": task_id, "model": model, "source": source},
-            )
-            response.raise_for_status()
-            logger.info(f"✅ Successfully triggered processing for {task_id}")
+        if existing_song:
+            # A previous attempt stored the original; the Spleeter service resumes from its checkpoint.
+            # The original sits in that song's bucket, so its visibility decides the source.
+            existing_source = "" if existing_song.is_global else "manual"
+            if existing_source != source.lower():
+                logger.info(f"🔁 {task_id} was first uploaded with source '{existing_source}', resuming with it")
+                source = existing_source
+            logger.info(f"🔁 Resuming processing for {task_id} (last status: {existing_song.processing_status})")
+        else:
+            bucket = PRIVATE_ORIGINAL_BUCKET if source.lower() == "manual" else PUBLIC_ORIGINAL_BUCKET
+            file_length = len(file_data)
+            file_stream = BytesIO(file_data)
+            with start_span("minio.put_object", bucket=bucket, object=task_id, size=file_length):
+                minio_client.put_object(
+                    bucket,
+                    task_id,
+                    data=file_stream,
+                    length=file_length,
+                    part_size=10 * 1024 * 1024
+                )
+            logger.info(f"✅ Original file uploaded: {task_id} to bucket: {bucket}")
 
-        async with SessionLocal() as db:
-            display_filename = to_snake_case(file.filename)
-            new_song = Song(
-                task_id=task_id,
-                title=display_filename,
-                processing_status="Pending",
-                is_global=False if source.lower() == "manual" else True
-            )
-            db.add(new_song)
-            await db.commit()
-            await db.refresh(new_song)
+            with start_span("redis.hset", task_id=task_id):
+                redis_client.hset(
+                    task_id,
+                    mapping={"status": "Uploaded", "progress": "0%", "trace_id": current_trace_id()}
+                )
 
-        return {
+            with start_span("db.create_song", task_id=task_id):
+                async with SessionLocal() as db:
+                    display_filename = to_snake_case(file.filename)
+                    new_song = Song(
+                        task_id=task_id,
+                        content_hash=content_hash,
+                        file_size=file_length,
+                        title=display_filename,
+                        processing_status="Uploaded",
+                        is_global=False if source.lower() == "manual" else True,
+                        # Private songs belong to the uploader so only they see them
+                        user_id=current_user.id if current_user and source.lower() == "manual" else None
+                    )
+                    db.add(new_song)
+                    await db.commit()
+
+        response = {
             "message": "Upload successful, processing started asynchronously",
             "task_id": task_id.replace(".mp3", ""),
-            "model": model
+            "model": model,
+            "provisional": progressive
         }
+        if progressive and existing_song and is_full_separation_pending(task_id):
+            # The preview is in place and its full pass is queued or running; redoing either gains nothing
+            logger.info(f"⏳ Full-quality processing for {task_id} is already queued")
+            return response
+
+        await set_song_status(task_id, "Processing")
+        if progressive:
+            # A quick provisional instrumental first; the requested model replaces it in the background
+            await trigger_separation(task_id, PREVIEW_MODEL, source, preview=True)
+            # Queue the full pass before announcing the preview, so a Previewable song always has one coming
+            span = current_span()
+            if not enqueue_full_separation(task_id, model, source, span.traceparent if span else None):
+                logger.info(f"⏳ Full-quality processing for {task_id} is already queued")
+            await set_song_status(task_id, "Previewable")
+            logger.info(f"✅ Preview ready for {task_id}, full-quality processing queued")
+        else:
+            await trigger_separation(task_id, model, source)
+            logger.info(f"✅ Successfully triggered processing for {task_id}")
+            await set_song_status(task_id, "Completed")
+
+        return response
+    except HTTPException:
+        raise
     except httpx.HTTPError as he:
         logger.error(f"❌ HTTP error during processing trigger for {task_id}: {str(he)}")
         raise HTTPException(status_code=500, detail=f"HTTP error: {str(he)}")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Boolean, DateTime
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, Boolean, DateTime
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -21,6 +21,8 @@ class Song(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     task_id = Column(String, unique=True, index=True, nullable=False)
+    content_hash = Column(String, index=True, nullable=True)  # MD5 of the original file
+    file_size = Column(BigInteger, nullable=True)
     title = Column(String, nullable=False)
     processing_status = Column(String, nullable=False, default="Pending")
     final_instrumental_url = Column(String, nullable=True)
@@ -1,9 +1,140 @@
 # backend/app/routes/song_router.py
-from fastapi import APIRouter
+import os
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from minio.error import S3Error
+
+from app.auth.routes import get_optional_user
+from app.config import PUBLIC_FINAL_BUCKET, PRIVATE_FINAL_BUCKET
+from app.database import get_db
+from app.models import Song, User
+from app.utils.storage import minio_client
 
 song_router = APIRouter()
 
+# Peaks and previews live under the song's task_id and are rewritten if the song is reprocessed.
+# URLs from /songs/{task_id}/artifacts carry the object's ETag as ?v=, so a response for the
+# current version never changes and is cached for good; a new version gets a new URL.
+# Unversioned (or outdated) URLs may be reused briefly and are then revalidated with the ETag.
+ARTIFACT_IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+ARTIFACT_MAX_AGE = 5 * 60
+
+# Artifact name -> (object suffix, media type)
+ARTIFACTS = {
+    "peaks": ("_peaks.bin", "application/octet-stream"),
+    "preview": ("_preview.mp3", "audio/mpeg")
+}
+
 @song_router.get("/songs", tags=["songs"])
 async def list_songs():
     # This is a placeholder. Replace with actual logic to fetch songs.
     return {"message": "List of songs goes here"}
+
+async def get_visible_song(task_id: str, db: AsyncSession, user: Optional[User]) -> Song:
+    """Look up a song by task_id (with or without extension), hiding private songs from other users."""
+    result = await db.execute(select(Song).filter(Song.task_id.in_([task_id, f"{task_id}.mp3"])))
+    song = result.scalars().first()
+    if not song:
+        raise HTTPException(status_code=404, detail="Song not found")
+    if not song.is_global and (user is None or (not user.is_admin and song.user_id != user.id)):
+        raise HTTPException(status_code=404, detail="Song not found")
+    return song
+
+def artifact_location(song: Song, suffix: str):
+    """Bucket and object name of an artifact stored next to the song's final instrumental."""
+    base_name, _ = os.path.splitext(song.task_id)
+    bucket = PUBLIC_FINAL_BUCKET if song.is_global else PRIVATE_FINAL_BUCKET
+    return bucket, f"{base_name}/{base_name}{suffix}"
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header (a list of ETags, possibly W/ or *) against an ETag."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+async def serve_artifact(request: Request, song: Song, suffix: str, media_type: str, version: Optional[str]) -> Response:
+    """Serve a precomputed artifact stored next to the song's final instrumental, with ETag revalidation."""
+    bucket, object_name = artifact_location(song, suffix)
+    try:
+        stat = await run_in_threadpool(minio_client.stat_object, bucket, object_name)
+    except S3Error:
+        raise HTTPException(status_code=404, detail="Artifact not available yet")
+
+    etag = f'"{stat.etag}"'
+    visibility = "public" if song.is_global else "private"
+    if version == stat.etag:
+        cache_control = f"{visibility}, max-age={ARTIFACT_IMMUTABLE_MAX_AGE}, immutable"
+    else:
+        cache_control = f"{visibility}, max-age={ARTIFACT_MAX_AGE}, must-revalidate"
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    def read_object() -> bytes:
+        response = minio_client.get_object(bucket, object_name)
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+    content = await run_in_threadpool(read_object)
+    return Response(content=content, media_type=media_type, headers=headers)
+
+@song_router.get("/songs/{task_id}/artifacts", tags=["songs"])
+async def get_song_artifacts(
+    task_id: str,
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[User] = Depends(get_optional_user)
+):
+    """
+    Returns versioned URLs of the song's peaks and preview (null while not available yet).
+    The URLs change whenever the artifact does, so clients can cache their responses indefinitely.
+    """
+    song = await get_visible_song(task_id, db, current_user)
+    base_name, _ = os.path.splitext(song.task_id)
+    urls = {}
+    for name, (suffix, _) in ARTIFACTS.items():
+        try:
+            stat = await run_in_threadpool(minio_client.stat_object, *artifact_location(song, suffix))
+        except S3Error:
+            urls[name] = None
+            continue
+        urls[name] = f"/songs/{base_name}/{name}?v={stat.etag}"
+    return urls
+
+@song_router.get("/songs/{task_id}/peaks", tags=["songs"])
+async def get_song_peaks(
+    task_id: str,
+    request: Request,
+    v: Optional[str] = Query(None, description="Artifact version from /songs/{task_id}/artifacts"),
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[User] = Depends(get_optional_user)
+):
+    """
+    Returns the waveform peak index of the final instrumental.
+    Binary layout: see spleeter_service/peaks.py (min/max int8 pairs per bucket, several resolutions).
+    """
+    song = await get_visible_song(task_id, db, current_user)
+    suffix, media_type = ARTIFACTS["peaks"]
+    return await serve_artifact(request, song, suffix, media_type, v)
+
+@song_router.get("/songs/{task_id}/preview", tags=["songs"])
+async def get_song_preview(
+    task_id: str,
+    request: Request,
+    v: Optional[str] = Query(None, description="Artifact version from /songs/{task_id}/artifacts"),
+    db: AsyncSession = Depends(get_db),
+    current_user: Optional[User] = Depends(get_optional_user)
+):
+    """Returns a short low-bitrate MP3 preview of the final instrumental."""
+    song = await get_visible_song(task_id, db, current_user)
+    suffix, media_type = ARTIFACTS["preview"]
+    return await serve_artifact(request, song, suffix, media_type, v)
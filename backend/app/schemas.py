@@ -0,0 +1,20 @@
+# backend/app/schemas.py
+from typing import List, Optional
+from pydantic import BaseModel, Field
+
+class UploadCheckItem(BaseModel):
+    hash: str = Field(..., description="MD5 hex digest of the file contents")
+    size: int = Field(..., ge=0, description="File size in bytes")
+
+class UploadCheckRequest(BaseModel):
+    files: List[UploadCheckItem] = Field(..., max_length=1000)
+
+class UploadCheckResult(BaseModel):
+    hash: str
+    size: int
+    known: bool
+    task_id: Optional[str] = None
+    processing_status: Optional[str] = None
+
+class UploadCheckResponse(BaseModel):
+    results: List[UploadCheckResult]
@@ -0,0 +1,11 @@
+# backend/app/utils/storage.py
+from minio import Minio
+from app.config import MINIO_ENDPOINT, MINIO_ACCESS_KEY, MINIO_SECRET_KEY
+
+# Initialize MinIO client with environment variables
+minio_client = Minio(
+    MINIO_ENDPOINT.replace("http://", ""),
+    access_key=MINIO_ACCESS_KEY,
+    secret_key=MINIO_SECRET_KEY,
+    secure=False
+)
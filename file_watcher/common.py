@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import re
 import sys
+import secrets
 
 def to_snake_case(name):
     # Replace spaces with underscores and lower all letters.
@@ -8,6 +9,12 @@ def to_snake_case(name):
     s = re.sub(r'([a-z0-9])([A-Z])', r'\1_\2', s)
     return s.replace(" ", "_").lower()
 
+def new_traceparent():
+    # W3C trace context for a new trace, sent to the backend with each upload.
+    return f"00-{secrets.token_hex(16)}-{secrets.token_hex(8)}-01"
+
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
+    if len(sys.argv) > 1 and sys.argv[1] == "--traceparent":
+        print(new_traceparent())
+    elif len(sys.argv) > 1:
         print(to_snake_case(sys.argv[1]))
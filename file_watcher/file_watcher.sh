@@ -19,6 +19,7 @@ DEST_DIR="/audio_files"
 
 # Define Backend API URL
 BACKEND_URL="http://backend:8000/upload/"
+CHECK_URL="http://backend:8000/upload/check"
 
 # Log file
 LOG_FILE="/tmp/file_watcher.log"
@@ -80,6 +81,10 @@ process_file() {
         fi
 
         FILENAME=$(basename "$FILE")
+        # Start a trace for this file; the backend and Spleeter service continue it
+        TRACEPARENT=$(python3 common.py --traceparent)
+        TRACE_ID=$(echo "$TRACEPARENT" | cut -d- -f2)
+        echo "Trace $TRACE_ID started for: $FILENAME" >> ${LOG_FILE}
         # Convert filename to snake_case using Python
         SNAKE_CASE_FILENAME=$(python3 common.py "$FILENAME")
         DEST_PATH="$DEST_DIR/$SNAKE_CASE_FILENAME"
@@ -99,20 +104,43 @@ process_file() {
         # Notify backend
         curl -X POST "http://backend:8000/status/track" \
              -H "Content-Type: application/json" \
+             -H "traceparent: $TRACEPARENT" \
              -d "{\"file_name\": \"$SNAKE_CASE_FILENAME\"}" >> ${LOG_FILE} 2>&1
 
+        # Ask the backend whether this content is already known before sending the bytes
+        CONTENT_HASH=$(md5sum "$DEST_PATH" | cut -d' ' -f1)
+        CONTENT_SIZE=$(stat -c%s "$DEST_PATH")
+        CHECK_RESPONSE=$(curl -s -o /dev/null -w "%{http_code}" -I \
+          -H "traceparent: $TRACEPARENT" \
+          "$CHECK_URL?hash=$CONTENT_HASH&size=$CONTENT_SIZE")
+        if [ "$CHECK_RESPONSE" -eq 200 ]; then
+            echo "Known content, skipping upload: $SNAKE_CASE_FILENAME ($CONTENT_HASH)" >> ${LOG_FILE}
+            return
+        fi
+
         # Trigger processing via backend API with retries
         for i in 1 2 3; do
+            if [ "$i" -gt 1 ]; then
+                # An earlier attempt may have registered the content even though the request failed
+                CHECK_RESPONSE=$(curl -s -o /dev/null -w "%{http_code}" -I \
+                  -H "traceparent: $TRACEPARENT" \
+                  "$CHECK_URL?hash=$CONTENT_HASH&size=$CONTENT_SIZE")
+                if [ "$CHECK_RESPONSE" -eq 200 ]; then
+                    echo "Content registered by an earlier attempt: $SNAKE_CASE_FILENAME" >> ${LOG_FILE}
+                    return
+                fi
+            fi
             RESPONSE=$(curl -s -o /dev/null -w "%{http_code}" -X POST "$BACKEND_URL" \
               -H "accept: application/json" \
               -H "Content-Type: multipart/form-data" \
+              -H "traceparent: $TRACEPARENT" \
               -F "file=@$DEST_PATH" \
               -F "model=5stems")
             if [ "$RESPONSE" -eq 200 ]; then
-                echo "API request successful for: $SNAKE_CASE_FILENAME" >> ${LOG_FILE}
+                echo "API request successful for: $SNAKE_CASE_FILENAME (trace $TRACE_ID)" >> ${LOG_FILE}
                 return
             else
-                echo "Attempt $i: API request failed (HTTP $RESPONSE), retrying..." >> ${LOG_FILE}
+                echo "Attempt $i: API request failed (HTTP $RESPONSE, trace $TRACE_ID), retrying..." >> ${LOG_FILE}
                 sleep 5
             fi
         done
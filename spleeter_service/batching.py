@@ -0,0 +1,295 @@
+# spleeter_service/batching.py
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from tracing import record_span
+
+# Batching limits: a batch is dispatched once it is full or its oldest job has waited long enough
+BATCH_MAX_SIZE = int(os.getenv("SPLEETER_BATCH_MAX_SIZE", "4"))
+BATCH_MAX_WAIT = float(os.getenv("SPLEETER_BATCH_MAX_WAIT", "2.0"))
+# Only inputs up to this many seconds share a forward pass; longer ones are separated on their own
+BATCH_MAX_DURATION = float(os.getenv("SPLEETER_BATCH_MAX_DURATION", "90"))
+
+SAMPLE_RATE = 44100
+# Spleeter's STFT window and hop, and the number of frames in each segment the U-Net sees on its own
+FRAME_LENGTH = 4096
+FRAME_STEP = 1024
+SEGMENT_FRAMES = 512
+# Inputs sharing a forward pass each take a whole number of segments (about 11.9 s each), so no
+# segment holds audio from two inputs and a track's stems do not depend on its batch mates
+SEGMENT_SAMPLES = SEGMENT_FRAMES * FRAME_STEP
+
+# Job priorities: interactive jobs are dispatched first and without waiting for a batch to fill
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+@dataclass
+class SeparationJob:
+    input_file: str
+    output_dir: str
+    model: str
+    duration: Optional[float]
+    priority: int
+    enqueued_at: float
+    future: asyncio.Future = field(repr=False)
+    # Wall-clock timings (microseconds) reported as tracing spans
+    queued_us: int = 0
+    started_us: int = 0
+    finished_us: int = 0
+    batch_size: int = 0
+    # Set by the first probe, so a deferred long input is not decoded again on later passes
+    is_long: Optional[bool] = None
+
+    @property
+    def base_name(self) -> str:
+        return os.path.splitext(os.path.basename(self.input_file))[0]
+
+    @property
+    def stem_dir(self) -> str:
+        return os.path.join(self.output_dir, self.base_name)
+
+def _now_us() -> int:
+    return int(time.time() * 1_000_000)
+
+class SeparationBatcher:
+    """
+    Collects pending separation jobs and runs them through Spleeter in batches.
+
+    Separation runs in-process on a single worker thread, so each model is loaded
+    once and stays loaded across jobs. Short inputs that use the same model are
+    aligned to the model's segments and separated in one forward pass. Longer inputs are
+    separated one by one. Each job is resolved as soon as its own stems are written.
+    Interactive jobs are picked ahead of background jobs and are dispatched without waiting.
+    """
+
+    def __init__(self, max_size: int = BATCH_MAX_SIZE, max_wait: float = BATCH_MAX_WAIT,
+                 max_duration: float = BATCH_MAX_DURATION):
+        self.max_size = max(1, max_size)
+        self.max_wait = max_wait
+        self.max_duration = max_duration
+        self._pending: List[SeparationJob] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        # TensorFlow sessions are kept on one thread; separation is CPU-bound anyway
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="spleeter")
+        self._separators: Dict[str, object] = {}
+        self._audio_adapter = None
+
+    def start(self) -> None:
+        if self._worker is None:
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, input_file: str, output_dir: str, model: str, duration: Optional[float] = None,
+                     priority: int = PRIORITY_BACKGROUND) -> None:
+        """
+        Queue a file for separation and wait until its stems are in output_dir/<base_name>/.
+        If duration is set, only the first duration seconds are separated.
+        Raises the underlying exception if separation fails for this file.
+        """
+        self.start()
+        loop = asyncio.get_running_loop()
+        job = SeparationJob(
+            input_file=input_file,
+            output_dir=output_dir,
+            model=model,
+            duration=duration,
+            priority=priority,
+            enqueued_at=loop.time(),
+            future=loop.create_future(),
+            queued_us=_now_us()
+        )
+        self._pending.append(job)
+        self._wakeup.set()
+        try:
+            await job.future
+        finally:
+            if job.started_us:
+                record_span("spleeter.queue", job.queued_us, job.started_us, model=model, priority=priority)
+                record_span(
+                    "spleeter.separate", job.started_us, job.finished_us or job.started_us,
+                    model=model, batch_size=job.batch_size
+                )
+
+    def _head(self) -> SeparationJob:
+        """The job to serve next: highest priority first, then oldest."""
+        return min(self._pending, key=lambda job: (job.priority, job.enqueued_at))
+
+    def _next_batch(self) -> List[SeparationJob]:
+        """Take up to max_size jobs sharing the head job's model, skipping duplicate base names."""
+        head = self._head()
+        batch, seen = [head], {head.base_name}
+        for job in sorted(self._pending, key=lambda job: (job.priority, job.enqueued_at)):
+            if len(batch) >= self.max_size:
+                break
+            if job is head or job.model != head.model or job.base_name in seen:
+                continue
+            batch.append(job)
+            seen.add(job.base_name)
+        for job in batch:
+            self._pending.remove(job)
+        return batch
+
+    def _ready_count(self, head: SeparationJob) -> int:
+        return sum(1 for job in self._pending if job.model == head.model)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            head = self._head()
+            if head.priority == PRIORITY_INTERACTIVE:
+                remaining = 0
+            else:
+                remaining = head.enqueued_at + self.max_wait - loop.time()
+            if self._ready_count(head) < self.max_size and remaining > 0:
+                # Wait for more jobs to arrive, but never past the oldest job's deadline
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            batch = self._next_batch()
+            try:
+                deferred = await loop.run_in_executor(self._executor, self._separate_batch, batch, loop)
+            except Exception as e:
+                for job in batch:
+                    self._resolve(loop, job, e)
+                continue
+            # Long inputs not reached in this pass go back to the queue, behind any interactive jobs
+            self._pending.extend(deferred)
+
+    def _resolve(self, loop: asyncio.AbstractEventLoop, job: SeparationJob, error: Optional[Exception]) -> None:
+        """Complete a job's future from the worker thread."""
+        def complete():
+            if job.future.done():
+                return
+            if error is None:
+                job.future.set_result(None)
+            else:
+                job.future.set_exception(error)
+        job.finished_us = _now_us()
+        loop.call_soon_threadsafe(complete)
+
+    def _separator(self, model: str):
+        if model not in self._separators:
+            from spleeter.separator import Separator
+            self._separators[model] = Separator(f"spleeter:{model}", multiprocess=False)
+        return self._separators[model]
+
+    def _adapter(self):
+        if self._audio_adapter is None:
+            from spleeter.audio.adapter import AudioAdapter
+            self._audio_adapter = AudioAdapter.default()
+        return self._audio_adapter
+
+    def _load(self, job: SeparationJob, limit: Optional[float] = None) -> np.ndarray:
+        durations = [d for d in (job.duration, limit) if d is not None]
+        waveform, _ = self._adapter().load(
+            job.input_file, offset=0, duration=min(durations) if durations else None, sample_rate=SAMPLE_RATE
+        )
+        return waveform
+
+    def _save(self, job: SeparationJob, stems: Dict[str, np.ndarray]) -> None:
+        os.makedirs(job.stem_dir, exist_ok=True)
+        for stem, data in stems.items():
+            self._adapter().save(os.path.join(job.stem_dir, f"{stem}.wav"), data, SAMPLE_RATE, "wav")
+
+    def _separate_batch(self, batch: List[SeparationJob], loop: asyncio.AbstractEventLoop) -> List[SeparationJob]:
+        """
+        Separate a batch on the worker thread, resolving each job as soon as it is done.
+        Short inputs share one forward pass. At most one long input is separated per
+        pass; the remaining long jobs are returned so they can be rescheduled.
+        """
+        separator = self._separator(batch[0].model)
+        started_us = _now_us()
+        max_samples = int(self.max_duration * SAMPLE_RATE)
+
+        # Probe with a bounded read: an input that fits under the limit is short
+        short, long_jobs = [], []
+        for job in batch:
+            job.started_us = started_us
+            if job.is_long:
+                long_jobs.append(job)
+                continue
+            try:
+                waveform = self._load(job, self.max_duration + 1)
+            except Exception as e:
+                self._resolve(loop, job, e)
+                continue
+            job.is_long = len(waveform) > max_samples
+            if job.is_long:
+                long_jobs.append(job)
+            else:
+                short.append((job, waveform))
+
+        if short:
+            for job, _ in short:
+                job.batch_size = len(short)
+            try:
+                self._separate_joined(separator, short)
+                for job, _ in short:
+                    self._resolve(loop, job, None)
+            except Exception:
+                # Fall back to one pass per input so a single bad input does not fail the others
+                for job, waveform in short:
+                    try:
+                        self._save(job, separator.separate(waveform))
+                        self._resolve(loop, job, None)
+                    except Exception as e:
+                        self._resolve(loop, job, e)
+
+        if not long_jobs:
+            return []
+        job = long_jobs[0]
+        job.started_us = _now_us()
+        job.batch_size = 1
+        try:
+            self._save(job, separator.separate(self._load(job)))
+            self._resolve(loop, job, None)
+        except Exception as e:
+            self._resolve(loop, job, e)
+        return long_jobs[1:]
+
+    def _separate_joined(self, separator, items: list) -> None:
+        """
+        Separate several short waveforms in one pass and split the stems back per job.
+        Each input is placed in its own run of whole segments, with at least one STFT
+        window of silence on both sides so no frame straddles two inputs either.
+        """
+        channels = max(waveform.shape[1] for _, waveform in items)
+        parts, bounds, position = [], [], 0
+        for _, waveform in items:
+            if waveform.shape[1] < channels:
+                waveform = np.repeat(waveform, channels, axis=1)
+            span = -(-(len(waveform) + 2 * FRAME_LENGTH) // SEGMENT_SAMPLES) * SEGMENT_SAMPLES
+            padded = np.zeros((span, channels), dtype=np.float32)
+            padded[FRAME_LENGTH:FRAME_LENGTH + len(waveform)] = waveform
+            parts.append(padded)
+            bounds.append((position + FRAME_LENGTH, position + FRAME_LENGTH + len(waveform)))
+            position += span
+
+        stems = separator.separate(np.concatenate(parts))
+        for (job, _), (start, end) in zip(items, bounds):
+            self._save(job, {stem: data[start:end] for stem, data in stems.items()})
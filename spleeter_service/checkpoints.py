@@ -0,0 +1,141 @@
+# spleeter_service/checkpoints.py
+import os
+import json
+import time
+import shutil
+from typing import Collection, Dict, List, Optional
+
+# Pipeline stages in execution order
+STAGES = ["fetch", "validate", "separate", "encode", "upload-stems", "merge", "artifacts", "upload-final"]
+
+class Checkpoint:
+    """
+    Durable record of the stages a task has completed and the artifacts they produced.
+
+    The record lives in checkpoint.json inside the task's work directory, next to the
+    artifacts themselves. Local files are stored relative to the work directory;
+    uploaded objects are stored as bucket/object pairs.
+    """
+
+    FILE_NAME = "checkpoint.json"
+
+    def __init__(self, work_dir: str, model: str, source: str):
+        self.work_dir = work_dir
+        self.path = os.path.join(work_dir, self.FILE_NAME)
+        self.current_stage: Optional[str] = None
+        self.params = {"model": model, "source": source.lower()}
+        self.stages: Dict[str, dict] = {}
+
+        data = self._load()
+        if data and data.get("params") == self.params:
+            self.stages = data.get("stages", {})
+        else:
+            # Missing, unreadable, or made with different parameters: start over
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+        os.makedirs(self.work_dir, exist_ok=True)
+        self._prune()
+
+    def _load(self) -> Optional[dict]:
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"params": self.params, "stages": self.stages}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _is_valid(self, stage: str) -> bool:
+        entry = self.stages.get(stage)
+        if entry is None:
+            return False
+        return all(os.path.exists(os.path.join(self.work_dir, p)) for p in entry["files"].values())
+
+    def _prune(self) -> None:
+        """Drop the first incomplete stage and everything after it, since later stages depend on it."""
+        # Stages no longer in the pipeline (e.g. renamed) are meaningless to a resume
+        for unknown in set(self.stages) - set(STAGES):
+            self.stages.pop(unknown)
+        if self.is_complete:
+            # Finished tasks no longer need their local artifacts
+            return
+        for index, stage in enumerate(STAGES):
+            if not self._is_valid(stage):
+                for stale in STAGES[index:]:
+                    self.stages.pop(stale, None)
+                break
+
+    @property
+    def last_completed(self) -> Optional[str]:
+        completed = [stage for stage in STAGES if stage in self.stages]
+        return completed[-1] if completed else None
+
+    @property
+    def is_complete(self) -> bool:
+        return STAGES[-1] in self.stages
+
+    def is_done(self, stage: str) -> bool:
+        return stage in self.stages
+
+    def begin(self, stage: str) -> None:
+        self.current_stage = stage
+
+    def record(self, stage: str, files: Dict[str, str] = None, objects: Dict[str, str] = None) -> None:
+        """Mark a stage complete with the local files and uploaded objects it produced."""
+        self.stages[stage] = {
+            "files": {k: os.path.relpath(v, self.work_dir) for k, v in (files or {}).items()},
+            "objects": dict(objects or {})
+        }
+        self._save()
+
+    def files(self, stage: str) -> Dict[str, str]:
+        entry = self.stages.get(stage, {"files": {}})
+        return {k: os.path.join(self.work_dir, p) for k, p in entry["files"].items()}
+
+    def objects(self, stage: str) -> Dict[str, str]:
+        return dict(self.stages.get(stage, {"objects": {}})["objects"])
+
+    def release_artifacts(self) -> None:
+        """Delete local artifacts but keep the record, so a repeated request is answered without reprocessing."""
+        for entry in os.listdir(self.work_dir):
+            if entry == self.FILE_NAME:
+                continue
+            path = os.path.join(self.work_dir, entry)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+
+    def clear(self) -> None:
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+def sweep_work_dirs(root: str, max_age: float, active: Collection[str] = ()) -> List[str]:
+    """
+    Delete task work directories that have not been touched for max_age seconds.
+    Covers abandoned failures (with all their artifacts) and the records left by
+    completed tasks. Directories named in active are in use and are skipped.
+    """
+    if not os.path.isdir(root):
+        return []
+    cutoff = time.time() - max_age
+    removed = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name in active or not os.path.isdir(path):
+            continue
+        record = os.path.join(path, Checkpoint.FILE_NAME)
+        try:
+            last_used = max(os.path.getmtime(path), os.path.getmtime(record) if os.path.exists(record) else 0)
+        except OSError:
+            continue
+        if last_used < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+            removed.append(name)
+    return removed
@@ -0,0 +1,92 @@
+# spleeter_service/peaks.py
+import os
+import struct
+import subprocess
+from typing import List
+
+import numpy as np
+
+# Decoding rate for peak extraction; waveform rendering does not need full bandwidth
+PEAKS_SAMPLE_RATE = int(os.getenv("PEAKS_SAMPLE_RATE", "8000"))
+# Samples per bucket for each resolution, finest first; each level must divide the next
+PEAKS_LEVELS = [512, 2048, 8192]
+
+# Preview clip settings
+PREVIEW_DURATION = float(os.getenv("PREVIEW_DURATION", "30"))
+PREVIEW_OFFSET = float(os.getenv("PREVIEW_OFFSET", "30"))
+PREVIEW_BITRATE = os.getenv("PREVIEW_BITRATE", "48k")
+
+# Peak file layout (little-endian):
+#   header: magic b"PEAK", version (u8), level count (u8), reserved (u16), sample rate (u32)
+#   per level: samples per bucket (u32), bucket count (u32)
+#   per level, in the same order: bucket count (min, max) pairs of int8
+PEAKS_MAGIC = b"PEAK"
+PEAKS_VERSION = 1
+_HEADER = struct.Struct("<4sBBHI")
+_LEVEL_HEADER = struct.Struct("<II")
+
+def decode_mono(input_file: str, sample_rate: int = PEAKS_SAMPLE_RATE) -> np.ndarray:
+    """Decode an audio file to mono 16-bit PCM using FFmpeg."""
+    cmd = [
+        "ffmpeg", "-v", "error", "-i", input_file,
+        "-ac", "1", "-ar", str(sample_rate), "-f", "s16le", "-"
+    ]
+    result = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return np.frombuffer(result.stdout, dtype="<i2")
+
+def _bucket_min_max(values_min: np.ndarray, values_max: np.ndarray, factor: int):
+    """Reduce min/max arrays by a factor, padding the last partial bucket."""
+    count = -(-len(values_min) // factor)
+    pad = count * factor - len(values_min)
+    if pad:
+        values_min = np.concatenate([values_min, np.full(pad, values_min[-1], values_min.dtype)])
+        values_max = np.concatenate([values_max, np.full(pad, values_max[-1], values_max.dtype)])
+    return values_min.reshape(count, factor).min(axis=1), values_max.reshape(count, factor).max(axis=1)
+
+def build_peaks(samples: np.ndarray, sample_rate: int = PEAKS_SAMPLE_RATE, levels: List[int] = PEAKS_LEVELS) -> bytes:
+    """
+    Build a multi-resolution peak index from 16-bit samples.
+    Each level stores the min and max of every bucket, scaled to int8.
+    """
+    if len(samples) == 0:
+        samples = np.zeros(1, dtype="<i2")
+    mins, maxs = _bucket_min_max(samples, samples, levels[0])
+    encoded_levels = []
+    previous = levels[0]
+    for level in levels:
+        if level != previous:
+            mins, maxs = _bucket_min_max(mins, maxs, level // previous)
+            previous = level
+        pairs = np.empty(len(mins) * 2, dtype=np.int8)
+        pairs[0::2] = (mins.astype(np.int32) >> 8).astype(np.int8)
+        pairs[1::2] = (maxs.astype(np.int32) >> 8).astype(np.int8)
+        encoded_levels.append((level, len(mins), pairs.tobytes()))
+
+    data = bytearray(_HEADER.pack(PEAKS_MAGIC, PEAKS_VERSION, len(encoded_levels), 0, sample_rate))
+    for level, count, _ in encoded_levels:
+        data += _LEVEL_HEADER.pack(level, count)
+    for _, _, pairs in encoded_levels:
+        data += pairs
+    return bytes(data)
+
+def write_peaks(input_file: str, output_file: str) -> float:
+    """Write the peak index for an audio file and return its duration in seconds."""
+    samples = decode_mono(input_file)
+    with open(output_file, "wb") as f:
+        f.write(build_peaks(samples))
+    return len(samples) / PEAKS_SAMPLE_RATE
+
+def make_preview(input_file: str, output_file: str, duration: float) -> None:
+    """
+    Cut a short low-bitrate mono preview with FFmpeg.
+    The clip starts at PREVIEW_OFFSET, moved earlier for short tracks so it stays full length.
+    """
+    start = max(0.0, min(PREVIEW_OFFSET, duration - PREVIEW_DURATION))
+    length = min(PREVIEW_DURATION, duration) if duration > 0 else PREVIEW_DURATION
+    fade_out = max(0.0, length - 1)
+    cmd = [
+        "ffmpeg", "-y", "-ss", f"{start:.2f}", "-t", f"{length:.2f}", "-i", input_file,
+        "-af", f"afade=t=in:d=1,afade=t=out:st={fade_out:.2f}:d=1",
+        "-ac", "1", "-codec:a", "libmp3lame", "-b:a", PREVIEW_BITRATE, output_file
+    ]
+    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -1,10 +1,20 @@
 # spleeter_service/spleeter_api.py
 import os
+import shutil
+import asyncio
 import subprocess
-import tempfile
-from fastapi import FastAPI, HTTPException, Query
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from minio import Minio
 from dotenv import load_dotenv
+import redis
+
+from batching import SeparationBatcher, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from checkpoints import Checkpoint, sweep_work_dirs
+from peaks import write_peaks, make_preview
+from tracing import TRACEPARENT_HEADER, start_span
 
 # Load environment variables
 load_dotenv()
@@ -24,6 +34,43 @@ PRIVATE_ORIGINAL_BUCKET = os.getenv("PRIVATE_ORIGINAL_BUCKET", "private-original
 PRIVATE_PROCESSED_BUCKET = os.getenv("PRIVATE_PROCESSED_BUCKET", "private-processed-stems")
 PRIVATE_FINAL_BUCKET = os.getenv("PRIVATE_FINAL_BUCKET", "private-final-instrumentals")
 
+# Persistent work area holding each task's checkpoint and intermediate artifacts
+WORK_DIR = os.getenv("SPLEETER_WORK_DIR", "/app/work")
+# Work directories untouched for this long are deleted, whether the task finished or was abandoned
+WORK_TTL_HOURS = float(os.getenv("SPLEETER_WORK_TTL_HOURS", "48"))
+WORK_SWEEP_INTERVAL = 60 * 60
+
+# Response header naming the stage a failed request stopped at
+STAGE_HEADER = "X-Pipeline-Stage"
+
+# Expected stems from Spleeter for each model
+MODEL_STEMS = {
+    "2stems": ["vocals", "accompaniment"],
+    "4stems": ["vocals", "drums", "bass", "other"],
+    "5stems": ["vocals", "piano", "drums", "bass", "other"]
+}
+
+# Preview pass: a fast model on the start of the track, producing a provisional instrumental
+PREVIEW_MODEL = os.getenv("PREVIEW_MODEL", "2stems")
+PREVIEW_SECONDS = float(os.getenv("PREVIEW_SECONDS", "60"))
+
+# Object metadata marking an instrumental as provisional
+PROVISIONAL_METADATA_KEY = "x-amz-meta-provisional"
+
+# One lock per active task so concurrent retries do not share a work directory
+# (work key -> {"lock": asyncio.Lock, "users": number of requests holding or waiting for it})
+task_locks = {}
+
+# Redis holds each task's status hash; the current stage is published there as it changes
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = os.getenv("REDIS_PORT", "6379")
+redis_client = redis.Redis(
+    host=REDIS_HOST, port=int(REDIS_PORT), decode_responses=True,
+    socket_connect_timeout=1, socket_timeout=1
+)
+# Stage updates are written from their own thread, in order, so a slow Redis never stalls the event loop
+stage_publisher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stage-publisher")
+
 # Initialize MinIO client (assuming HTTP, non-secure)
 minio_client = Minio(
     MINIO_ENDPOINT.replace("http://", ""),
@@ -45,12 +92,71 @@ def validate_mp3(file_path: str) -> bool:
     except subprocess.CalledProcessError:
         return False
 
-def run_spleeter(input_file: str, output_dir: str, model: str = "5stems") -> None:
-    """Run Spleeter to separate audio stems."""
+# Shared batcher so concurrent jobs are separated in as few Spleeter runs as possible
+batcher = SeparationBatcher()
+
+@app.on_event("startup")
+async def on_startup():
+    batcher.start()
+    app.state.work_sweeper = asyncio.create_task(sweep_work_dir_periodically())
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    app.state.work_sweeper.cancel()
+    await batcher.stop()
+
+async def sweep_work_dir_periodically():
+    """Remove stale task work directories once an hour."""
+    while True:
+        try:
+            await run_in_threadpool(sweep_work_dirs, WORK_DIR, WORK_TTL_HOURS * 3600, set(task_locks))
+        except Exception:
+            pass  # retried on the next sweep
+        await asyncio.sleep(WORK_SWEEP_INTERVAL)
+
+@asynccontextmanager
+async def task_lock(work_key: str):
+    """Serialize requests for one task; the entry is dropped once no request needs it."""
+    entry = task_locks.setdefault(work_key, {"lock": asyncio.Lock(), "users": 0})
+    entry["users"] += 1
+    try:
+        async with entry["lock"]:
+            yield
+    finally:
+        entry["users"] -= 1
+        if entry["users"] == 0:
+            task_locks.pop(work_key, None)
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # Continue the backend's trace so the separation shows up under the original upload
+    with start_span(
+        f"{request.method} {request.url.path}",
+        traceparent=request.headers.get(TRACEPARENT_HEADER),
+        http_method=request.method,
+        http_path=request.url.path,
+        task_id=request.query_params.get("file_name", "")
+    ) as span:
+        response = await call_next(request)
+        span.set_tag("http_status_code", response.status_code)
+        return response
+
+async def run_traced(span_name: str, func, *args):
+    """Run a blocking call (MinIO or ffmpeg) in the threadpool inside a tracing span."""
+    with start_span(span_name):
+        return await run_in_threadpool(func, *args)
+
+async def run_spleeter(input_file: str, output_dir: str, model: str = "5stems", preview: bool = False) -> None:
+    """
+    Queue a file for Spleeter separation and wait until its stems are written.
+    Preview jobs are limited to PREVIEW_SECONDS and are served ahead of full runs.
+    """
     try:
-        cmd = ["python", "-m", "spleeter", "separate", "-p", f"spleeter:{model}", "-o", output_dir, input_file]
-        subprocess.run(cmd, check=True)
-    except subprocess.CalledProcessError as e:
+        if preview:
+            await batcher.submit(input_file, output_dir, model, PREVIEW_SECONDS, PRIORITY_INTERACTIVE)
+        else:
+            await batcher.submit(input_file, output_dir, model, priority=PRIORITY_BACKGROUND)
+    except Exception as e:
         raise HTTPException(status_code=500, detail=f"Spleeter processing failed: {str(e)}")
 
 def convert_wav_to_mp3(input_wav: str, output_mp3: str) -> None:
@@ -63,6 +169,10 @@ def merge_mp3_files(input_files: list, output_file: str) -> None:
     Merge multiple mp3 files using ffmpeg amix filter.
     This command mixes the input tracks with a duration equal to the longest input.
     """
+    if len(input_files) == 1:
+        # Nothing to mix (e.g. the 2stems accompaniment)
+        shutil.copyfile(input_files[0], output_file)
+        return
     cmd = ["ffmpeg", "-y"]
     for infile in input_files:
         cmd.extend(["-i", infile])
@@ -71,95 +181,255 @@ def merge_mp3_files(input_files: list, output_file: str) -> None:
     cmd.extend(["-filter_complex", filter_complex, output_file])
     subprocess.run(cmd, check=True)
 
+def publish_stage(task_id: str, stage: str) -> None:
+    try:
+        redis_client.hset(task_id, mapping={"stage": stage})
+    except redis.RedisError:
+        pass  # progress reporting must never fail the job
+
+@contextmanager
+def pipeline_stage(checkpoint: Checkpoint, task_id: str, stage: str, preview: bool = False):
+    """Mark a stage as the one in progress, publish it to the task's Redis hash and time it as a span."""
+    checkpoint.begin(stage)
+    stage_publisher.submit(publish_stage, task_id, f"preview {stage}" if preview else stage)
+    with start_span(f"stage.{stage}"):
+        yield
+
+def stage_error(checkpoint: Checkpoint, error: HTTPException) -> HTTPException:
+    """Tag an error with the stage that raised it, discarding checkpoints that cannot be resumed."""
+    # A missing or corrupted original will not fix itself on retry
+    if checkpoint.current_stage in ("fetch", "validate"):
+        checkpoint.clear()
+    error.headers = {**(error.headers or {}), STAGE_HEADER: checkpoint.current_stage or ""}
+    return error
+
+def is_final_instrumental(bucket: str, object_name: str) -> bool:
+    """True if a non-provisional instrumental has already been uploaded."""
+    try:
+        stat = minio_client.stat_object(bucket, object_name)
+    except Exception:
+        return False
+    return (stat.metadata or {}).get(PROVISIONAL_METADATA_KEY) != "true"
+
+async def run_pipeline(checkpoint: Checkpoint, file_name: str, model: str, source: str, preview: bool = False) -> dict:
+    """
+    Runs each pipeline stage that the checkpoint has not already recorded.
+    A stage records its artifacts as soon as it finishes, so a retry resumes
+    from the first incomplete stage.
+
+    In preview mode only the start of the track is separated, stems, peaks and the
+    preview clip are skipped, and the instrumental is uploaded as provisional.
+    """
+    is_manual = source.lower() == "manual"
+    base_name, _ = os.path.splitext(file_name)
+    local_input = os.path.join(checkpoint.work_dir, file_name)
+    output_dir = os.path.join(checkpoint.work_dir, "output")
+    processed_dir = os.path.join(output_dir, base_name)
+
+    if not checkpoint.is_done("fetch"):
+        with pipeline_stage(checkpoint, file_name, "fetch", preview):
+            # Determine original file bucket based on source
+            orig_bucket = PRIVATE_ORIGINAL_BUCKET if is_manual else PUBLIC_ORIGINAL_BUCKET
+            try:
+                await run_traced("minio.fget_object", minio_client.fget_object, orig_bucket, file_name, local_input)
+            except Exception as e:
+                raise HTTPException(status_code=404, detail=f"Original file not found: {str(e)}")
+            checkpoint.record("fetch", files={"input": local_input})
+
+    if not checkpoint.is_done("validate"):
+        with pipeline_stage(checkpoint, file_name, "validate", preview):
+            if not await run_traced("ffmpeg.validate", validate_mp3, local_input):
+                raise HTTPException(status_code=400, detail="Uploaded MP3 file is corrupted or invalid.")
+            checkpoint.record("validate")
+
+    if not checkpoint.is_done("separate"):
+        with pipeline_stage(checkpoint, file_name, "separate", preview):
+            os.makedirs(output_dir, exist_ok=True)
+            await run_spleeter(local_input, output_dir, model, preview)
+
+            # Spleeter creates a folder named after the base filename (without extension)
+            if not os.path.exists(processed_dir):
+                raise HTTPException(status_code=404, detail="Spleeter output directory not found.")
+            wav_files = {}
+            for stem in MODEL_STEMS[model]:
+                wav_file = os.path.join(processed_dir, f"{stem}.wav")
+                if not os.path.exists(wav_file):
+                    # For essential non-vocal stems, fail if missing
+                    if stem != "vocals":
+                        raise HTTPException(status_code=404, detail=f"Expected stem {stem}.wav not found.")
+                    continue  # vocals can be optional for merging
+                wav_files[stem] = wav_file
+            checkpoint.record("separate", files=wav_files)
+
+    if not checkpoint.is_done("encode"):
+        with pipeline_stage(checkpoint, file_name, "encode", preview):
+            converted_files = {}
+            for stem, wav_file in checkpoint.files("separate").items():
+                if preview and stem == "vocals":
+                    continue  # only the instrumental is needed for a preview
+                mp3_file = os.path.join(processed_dir, f"{base_name}_{stem}.mp3")
+                await run_traced("ffmpeg.encode", convert_wav_to_mp3, wav_file, mp3_file)
+                converted_files[stem] = mp3_file
+            checkpoint.record("encode", files=converted_files)
+    converted_files = checkpoint.files("encode")
+
+    if preview and not checkpoint.is_done("upload-stems"):
+        # Provisional stems come from a different model and are not kept
+        checkpoint.record("upload-stems")
+
+    if not checkpoint.is_done("upload-stems"):
+        with pipeline_stage(checkpoint, file_name, "upload-stems", preview):
+            # Determine processed stems bucket based on source
+            proc_bucket = PRIVATE_PROCESSED_BUCKET if is_manual else PUBLIC_PROCESSED_BUCKET
+            # Upload each converted stem into a folder named after the base filename
+            uploaded = {}
+            for stem, mp3_path in converted_files.items():
+                object_name = f"{base_name}/{base_name}_{stem}.mp3"
+                try:
+                    await run_traced("minio.fput_object", minio_client.fput_object, proc_bucket, object_name, mp3_path)
+                except Exception as e:
+                    raise HTTPException(status_code=500, detail=f"Failed to upload processed stem {stem}: {str(e)}")
+                uploaded[stem] = f"{proc_bucket}/{object_name}"
+            checkpoint.record("upload-stems", objects=uploaded)
+
+    if not checkpoint.is_done("merge"):
+        with pipeline_stage(checkpoint, file_name, "merge", preview):
+            # Merge non-vocal stems (e.g. piano, drums, bass, other) into final instrumental
+            non_vocal_stems = []
+            for stem in MODEL_STEMS[model]:
+                if stem != "vocals" and stem in converted_files:
+                    non_vocal_stems.append(converted_files[stem])
+            if not non_vocal_stems:
+                raise HTTPException(status_code=404, detail="No non-vocal stems available for merging.")
+
+            final_instrumental = os.path.join(processed_dir, f"{base_name}_instrumental.mp3")
+            await run_traced("ffmpeg.merge", merge_mp3_files, non_vocal_stems, final_instrumental)
+            checkpoint.record("merge", files={"instrumental": final_instrumental})
+
+    if preview and not checkpoint.is_done("artifacts"):
+        # Peaks and the preview clip are computed from the full-quality instrumental only
+        checkpoint.record("artifacts")
+
+    if not checkpoint.is_done("artifacts"):
+        with pipeline_stage(checkpoint, file_name, "artifacts", preview):
+            # Precompute a waveform peak index and a short preview clip for list views
+            final_instrumental = checkpoint.files("merge")["instrumental"]
+            peaks_file = os.path.join(processed_dir, f"{base_name}_peaks.bin")
+            preview_file = os.path.join(processed_dir, f"{base_name}_preview.mp3")
+            duration = await run_traced("ffmpeg.peaks", write_peaks, final_instrumental, peaks_file)
+            await run_traced("ffmpeg.preview", make_preview, final_instrumental, preview_file, duration)
+            checkpoint.record("artifacts", files={"peaks": peaks_file, "preview": preview_file})
+
+    if not checkpoint.is_done("upload-final"):
+        with pipeline_stage(checkpoint, file_name, "upload-final", preview):
+            # Determine final instrumentals bucket based on source
+            final_bucket = PRIVATE_FINAL_BUCKET if is_manual else PUBLIC_FINAL_BUCKET
+            object_name_final = f"{base_name}/{base_name}_instrumental.mp3"
+            # Peaks and preview go up first so they exist whenever the instrumental does
+            extras = {} if preview else {
+                "peaks": (f"{base_name}/{base_name}_peaks.bin", "application/octet-stream"),
+                "preview": (f"{base_name}/{base_name}_preview.mp3", "audio/mpeg")
+            }
+            uploaded = {}
+            for name, (object_name, content_type) in extras.items():
+                try:
+                    await run_traced(
+                        "minio.fput_object",
+                        minio_client.fput_object,
+                        final_bucket,
+                        object_name,
+                        checkpoint.files("artifacts")[name],
+                        content_type
+                    )
+                except Exception as e:
+                    raise HTTPException(status_code=500, detail=f"Failed to upload {name}: {str(e)}")
+                uploaded[name] = f"{final_bucket}/{object_name}"
+
+            # A single PUT replaces any provisional instrumental atomically
+            metadata = {"provisional": "true" if preview else "false"}
+            # Never overwrite a full-quality result that is already in place with a preview
+            superseded = preview and await run_traced(
+                "minio.stat_object", is_final_instrumental, final_bucket, object_name_final
+            )
+            if not superseded:
+                try:
+                    await run_traced(
+                        "minio.fput_object",
+                        minio_client.fput_object,
+                        final_bucket,
+                        object_name_final,
+                        checkpoint.files("merge")["instrumental"],
+                        "audio/mpeg",
+                        metadata
+                    )
+                except Exception as e:
+                    raise HTTPException(status_code=500, detail=f"Failed to upload final instrumental: {str(e)}")
+            uploaded["instrumental"] = f"{final_bucket}/{object_name_final}"
+            checkpoint.record("upload-final", objects=uploaded)
+
+    if preview:
+        return {
+            "message": "Preview separation successful",
+            "final_instrumental": f"{base_name}_instrumental.mp3",
+            "provisional": True,
+            "stage": checkpoint.last_completed
+        }
+    return {
+        "message": "Separation and processing successful",
+        "final_instrumental": f"{base_name}_instrumental.mp3",
+        "processed_stems_folder": base_name,
+        "peaks": f"{base_name}_peaks.bin",
+        "preview": f"{base_name}_preview.mp3",
+        "provisional": False,
+        "stage": checkpoint.last_completed
+    }
+
 @app.post("/separate")
 async def separate_audio(
     file_name: str = Query(..., description="The task_id of the file to process"),
     model: str = Query("5stems", description="Separation model to use"),
-    source: str = Query("", description="Source identifier: 'manual' for user uploads, empty for auto downloads")
+    source: str = Query("", description="Source identifier: 'manual' for user uploads, empty for auto downloads"),
+    preview: bool = Query(False, description="Fast provisional pass over the start of the track")
 ):
     """
     Processes an audio file using Spleeter:
       - Downloads the file from MinIO.
       - Validates the file.
-      - Runs Spleeter to separate stems.
+      - Runs Spleeter to separate stems (batched with other pending jobs).
       - Converts each WAV stem to MP3.
       - Uploads the converted stems to the processed stems bucket.
       - Merges non-vocal stems into a final instrumental MP3.
-      - Uploads the final instrumental to the final instrumentals bucket.
+      - Computes waveform peaks and a low-bitrate preview clip of the instrumental.
+      - Uploads the final instrumental, peaks and preview to the final instrumentals bucket.
+
+    Every stage is checkpointed in the task's work directory. A retry after a
+    failure resumes from the first incomplete stage instead of starting over.
+    The failing stage is reported in the X-Pipeline-Stage response header.
+
+    With preview=true, the first PREVIEW_SECONDS are separated with PREVIEW_MODEL
+    ahead of queued full runs, and the result is uploaded as a provisional
+    instrumental. A later full run replaces it.
     """
-    # Determine original file bucket based on source
-    orig_bucket = PRIVATE_ORIGINAL_BUCKET if source.lower() == "manual" else PUBLIC_ORIGINAL_BUCKET
+    if preview:
+        model = PREVIEW_MODEL
+    if model not in MODEL_STEMS:
+        raise HTTPException(status_code=400, detail=f"Unsupported model: {model}")
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        local_input = os.path.join(temp_dir, file_name)
+    base_name, _ = os.path.splitext(file_name)
+    work_key = f"{base_name}.preview" if preview else base_name
+    async with task_lock(work_key):
+        checkpoint = Checkpoint(os.path.join(WORK_DIR, work_key), model, source)
+        resumed_from = checkpoint.last_completed
         try:
-            minio_client.fget_object(orig_bucket, file_name, local_input)
+            result = await run_pipeline(checkpoint, file_name, model, source, preview)
+        except HTTPException as e:
+            raise stage_error(checkpoint, e)
         except Exception as e:
-            raise HTTPException(status_code=404, detail=f"Original file not found: {str(e)}")
-
-        if not validate_mp3(local_input):
-            raise HTTPException(status_code=400, detail="Uploaded MP3 file is corrupted or invalid.")
-
-        # Create an output directory for Spleeter processing
-        output_dir = os.path.join(temp_dir, "output")
-        os.makedirs(output_dir, exist_ok=True)
-
-        run_spleeter(local_input, output_dir, model)
-
-        # Spleeter creates a folder named after the base filename (without extension)
-        base_name, _ = os.path.splitext(file_name)
-        processed_dir = os.path.join(output_dir, base_name)
-        if not os.path.exists(processed_dir):
-            raise HTTPException(status_code=404, detail="Spleeter output directory not found.")
-
-        # Expected stems from Spleeter
-        stems = ["vocals", "piano", "drums", "bass", "other"]
-        converted_files = {}
-        for stem in stems:
-            wav_file = os.path.join(processed_dir, f"{stem}.wav")
-            if not os.path.exists(wav_file):
-                # For essential non-vocal stems, fail if missing
-                if stem != "vocals":
-                    raise HTTPException(status_code=404, detail=f"Expected stem {stem}.wav not found.")
-                continue  # vocals can be optional for merging
-            mp3_file = os.path.join(processed_dir, f"{base_name}_{stem}.mp3")
-            convert_wav_to_mp3(wav_file, mp3_file)
-            converted_files[stem] = mp3_file
-
-        # Determine processed stems bucket based on source
-        proc_bucket = PRIVATE_PROCESSED_BUCKET if source.lower() == "manual" else PUBLIC_PROCESSED_BUCKET
-        # Upload each converted stem into a folder named after the base filename
-        for stem, mp3_path in converted_files.items():
-            object_name = f"{base_name}/{base_name}_{stem}.mp3"
-            try:
-                minio_client.fput_object(proc_bucket, object_name, mp3_path)
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Failed to upload processed stem {stem}: {str(e)}")
-
-        # Merge non-vocal stems (piano, drums, bass, other) into final instrumental
-        non_vocal_stems = []
-        for stem in ["piano", "drums", "bass", "other"]:
-            if stem in converted_files:
-                non_vocal_stems.append(converted_files[stem])
-        if not non_vocal_stems:
-            raise HTTPException(status_code=404, detail="No non-vocal stems available for merging.")
-
-        final_instrumental = os.path.join(processed_dir, f"{base_name}_instrumental.mp3")
-        merge_mp3_files(non_vocal_stems, final_instrumental)
-
-        # Determine final instrumentals bucket based on source
-        final_bucket = PRIVATE_FINAL_BUCKET if source.lower() == "manual" else PUBLIC_FINAL_BUCKET
-        object_name_final = f"{base_name}/{base_name}_instrumental.mp3"
-        try:
-            minio_client.fput_object(final_bucket, object_name_final, final_instrumental)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to upload final instrumental: {str(e)}")
+            raise stage_error(checkpoint, HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")) from e
 
-        return {
-            "message": "Separation and processing successful",
-            "final_instrumental": f"{base_name}_instrumental.mp3",
-            "processed_stems_folder": base_name
-        }
+        checkpoint.release_artifacts()
+        result["resumed_from"] = resumed_from
+        return result
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,6 @@
+# spleeter_service/tests/conftest.py
+import os
+import sys
+
+# The service's modules import each other as top-level modules (they run from /app in the image)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
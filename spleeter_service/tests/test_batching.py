@@ -0,0 +1,116 @@
+# spleeter_service/tests/test_batching.py
+import asyncio
+
+import numpy as np
+
+from batching import FRAME_LENGTH, SAMPLE_RATE, SEGMENT_SAMPLES, SeparationBatcher
+
+class FakeSeparator:
+    """Returns the input as the accompaniment and its negation as the vocals."""
+
+    def __init__(self):
+        self.inputs = []
+
+    def separate(self, waveform: np.ndarray) -> dict:
+        self.inputs.append(waveform)
+        return {"vocals": -waveform, "accompaniment": waveform.copy()}
+
+def make_batcher(sources: dict, max_duration: float):
+    batcher = SeparationBatcher(max_size=4, max_wait=0.05, max_duration=max_duration)
+    separator = FakeSeparator()
+    loads, saved = [], {}
+
+    def load(job, limit=None):
+        loads.append((job.base_name, limit))
+        waveform = sources[job.input_file]
+        return waveform[:int(limit * SAMPLE_RATE)] if limit is not None else waveform
+
+    def save(job, stems):
+        saved[job.base_name] = stems
+
+    batcher._separators["2stems"] = separator
+    batcher._load = load
+    batcher._save = save
+    return batcher, separator, loads, saved
+
+def test_mixed_batch_joins_short_inputs_and_runs_long_ones_alone():
+    rng = np.random.default_rng(0)
+    lengths = {"short1": 1000, "short2": 3000, "long1": 50000, "long2": 60000}
+    sources = {
+        f"/in/{name}.mp3": rng.uniform(-1, 1, (length, 2)).astype(np.float32)
+        for name, length in lengths.items()
+    }
+    # Anything over one second counts as long
+    batcher, separator, loads, saved = make_batcher(sources, max_duration=1.0)
+
+    async def run():
+        try:
+            await asyncio.gather(*(batcher.submit(path, "/out", "2stems") for path in sources))
+        finally:
+            await batcher.stop()
+
+    asyncio.run(run())
+
+    # One joined pass for both short inputs, then one pass per long input
+    assert len(separator.inputs) == 3
+    joined = separator.inputs[0]
+    assert len(joined) % SEGMENT_SAMPLES == 0
+    assert len(joined) == 2 * SEGMENT_SAMPLES
+    # Each short input starts one STFT window into its own segment
+    np.testing.assert_array_equal(joined[FRAME_LENGTH:FRAME_LENGTH + 1000], sources["/in/short1.mp3"])
+    np.testing.assert_array_equal(
+        joined[SEGMENT_SAMPLES + FRAME_LENGTH:SEGMENT_SAMPLES + FRAME_LENGTH + 3000], sources["/in/short2.mp3"]
+    )
+    assert sorted(len(waveform) for waveform in separator.inputs[1:]) == [50000, 60000]
+
+    # Stems are split back to exactly each job's own audio
+    for name in lengths:
+        np.testing.assert_array_equal(saved[name]["accompaniment"], sources[f"/in/{name}.mp3"])
+
+    # The deferred long input is probed once, not again when it is picked up later
+    probes = [name for name, limit in loads if limit is not None]
+    assert sorted(probes) == sorted(lengths)
+
+def test_interactive_job_skips_the_batch_wait():
+    sources = {"/in/song.mp3": np.zeros((100, 2), dtype=np.float32)}
+    batcher, separator, _, saved = make_batcher(sources, max_duration=1.0)
+    batcher.max_wait = 60
+
+    async def run():
+        try:
+            await asyncio.wait_for(batcher.submit("/in/song.mp3", "/out", "2stems", priority=0), timeout=5)
+        finally:
+            await batcher.stop()
+
+    asyncio.run(run())
+    assert "song" in saved
+
+def test_failed_input_does_not_fail_its_batch_mates():
+    sources = {
+        "/in/good.mp3": np.ones((100, 2), dtype=np.float32),
+        "/in/bad.mp3": np.ones((200, 2), dtype=np.float32)
+    }
+    batcher, separator, _, saved = make_batcher(sources, max_duration=1.0)
+
+    def separate(waveform):
+        separator.inputs.append(waveform)
+        if len(waveform) == 200:
+            raise RuntimeError("bad input")
+        if len(waveform) % SEGMENT_SAMPLES == 0:
+            raise RuntimeError("joined pass failed")
+        return {"accompaniment": waveform.copy()}
+
+    separator.separate = separate
+
+    async def run():
+        try:
+            return await asyncio.gather(
+                *(batcher.submit(path, "/out", "2stems") for path in sources), return_exceptions=True
+            )
+        finally:
+            await batcher.stop()
+
+    results = dict(zip(sources, asyncio.run(run())))
+    assert results["/in/good.mp3"] is None
+    assert isinstance(results["/in/bad.mp3"], RuntimeError)
+    assert list(saved) == ["good"]
@@ -0,0 +1,84 @@
+# spleeter_service/tests/test_checkpoints.py
+import os
+import json
+import time
+
+from checkpoints import STAGES, Checkpoint, sweep_work_dirs
+
+def touch(path: str) -> str:
+    with open(path, "w") as f:
+        f.write("data")
+    return path
+
+def run_until(checkpoint: Checkpoint, last_stage: str) -> None:
+    """Record every stage up to and including last_stage, each with one local file."""
+    for stage in STAGES[:STAGES.index(last_stage) + 1]:
+        checkpoint.begin(stage)
+        checkpoint.record(stage, files={"out": touch(os.path.join(checkpoint.work_dir, f"{stage}.out"))})
+
+def test_resume_after_failure_at_upload_final(tmp_path):
+    work_dir = str(tmp_path / "song")
+    checkpoint = Checkpoint(work_dir, "5stems", "manual")
+    run_until(checkpoint, "artifacts")
+    checkpoint.begin("upload-final")  # fails before recording
+
+    resumed = Checkpoint(work_dir, "5stems", "manual")
+    assert resumed.last_completed == "artifacts"
+    assert not resumed.is_done("upload-final")
+    assert not resumed.is_complete
+    assert resumed.files("artifacts") == {"out": os.path.join(work_dir, "artifacts.out")}
+
+def test_missing_artifact_drops_its_stage_and_later_ones(tmp_path):
+    work_dir = str(tmp_path / "song")
+    checkpoint = Checkpoint(work_dir, "5stems", "")
+    run_until(checkpoint, "merge")
+    os.remove(os.path.join(work_dir, "encode.out"))
+
+    resumed = Checkpoint(work_dir, "5stems", "")
+    assert resumed.last_completed == "separate"
+    assert not resumed.is_done("upload-stems")
+
+def test_params_mismatch_resets_work_dir(tmp_path):
+    work_dir = str(tmp_path / "song")
+    checkpoint = Checkpoint(work_dir, "5stems", "manual")
+    run_until(checkpoint, "separate")
+
+    restarted = Checkpoint(work_dir, "2stems", "manual")
+    assert restarted.last_completed is None
+    assert os.listdir(work_dir) == []
+
+def test_unknown_stages_are_dropped(tmp_path):
+    work_dir = str(tmp_path / "song")
+    checkpoint = Checkpoint(work_dir, "5stems", "")
+    run_until(checkpoint, "fetch")
+    with open(checkpoint.path) as f:
+        data = json.load(f)
+    data["stages"]["preview"] = {"files": {}, "objects": {}}
+    with open(checkpoint.path, "w") as f:
+        json.dump(data, f)
+
+    assert "preview" not in Checkpoint(work_dir, "5stems", "").stages
+
+def test_completed_task_keeps_record_after_release(tmp_path):
+    work_dir = str(tmp_path / "song")
+    checkpoint = Checkpoint(work_dir, "5stems", "")
+    run_until(checkpoint, "upload-final")
+    checkpoint.release_artifacts()
+
+    assert os.listdir(work_dir) == [Checkpoint.FILE_NAME]
+    assert Checkpoint(work_dir, "5stems", "").is_complete
+
+def test_sweep_removes_only_stale_inactive_dirs(tmp_path):
+    stale = Checkpoint(str(tmp_path / "stale"), "5stems", "")
+    stale.record("fetch")
+    busy = Checkpoint(str(tmp_path / "busy"), "5stems", "")
+    busy.record("fetch")
+    fresh = Checkpoint(str(tmp_path / "fresh"), "5stems", "")
+    fresh.record("fetch")
+    old = time.time() - 3600
+    for path in (stale.work_dir, stale.path, busy.work_dir, busy.path):
+        os.utime(path, (old, old))
+
+    removed = sweep_work_dirs(str(tmp_path), max_age=60, active={"busy"})
+    assert removed == ["stale"]
+    assert sorted(os.listdir(tmp_path)) == ["busy", "fresh"]
@@ -0,0 +1,39 @@
+# spleeter_service/tests/test_peaks.py
+import numpy as np
+
+from peaks import PEAKS_MAGIC, PEAKS_VERSION, _HEADER, _LEVEL_HEADER, build_peaks
+
+def parse_peaks(data: bytes) -> dict:
+    magic, version, level_count, _, sample_rate = _HEADER.unpack_from(data, 0)
+    offset = _HEADER.size
+    levels = []
+    for _ in range(level_count):
+        levels.append(_LEVEL_HEADER.unpack_from(data, offset))
+        offset += _LEVEL_HEADER.size
+    pairs = {}
+    for level, count in levels:
+        pairs[level] = np.frombuffer(data, dtype=np.int8, count=count * 2, offset=offset).reshape(count, 2)
+        offset += count * 2
+    return {"magic": magic, "version": version, "sample_rate": sample_rate, "pairs": pairs, "end": offset}
+
+def test_header_round_trip():
+    samples = np.zeros(10000, dtype="<i2")
+    samples[600] = 32767
+    samples[700] = -32768
+    data = build_peaks(samples, sample_rate=8000, levels=[512, 2048])
+
+    parsed = parse_peaks(data)
+    assert parsed["magic"] == PEAKS_MAGIC
+    assert parsed["version"] == PEAKS_VERSION
+    assert parsed["sample_rate"] == 8000
+    assert parsed["end"] == len(data)
+    assert [len(pairs) for pairs in parsed["pairs"].values()] == [20, 5]
+
+    # The loud samples land in the second fine bucket and the first coarse one
+    assert parsed["pairs"][512][1].tolist() == [-128, 127]
+    assert parsed["pairs"][512][0].tolist() == [0, 0]
+    assert parsed["pairs"][2048][0].tolist() == [-128, 127]
+
+def test_empty_input_still_has_one_bucket():
+    parsed = parse_peaks(build_peaks(np.zeros(0, dtype="<i2"), levels=[512, 2048]))
+    assert [len(pairs) for pairs in parsed["pairs"].values()] == [1, 1]
@@ -0,0 +1,189 @@
+# spleeter_service/tracing.py
+# Copy of the parts of backend/app/tracing.py this service uses (it only continues incoming traces).
+# The backend and this service are built from separate Docker contexts (./backend, ./spleeter_service),
+# so the module cannot be shared; keep span format and exporter behaviour in sync with the backend's.
+import os
+import json
+import time
+import queue
+import secrets
+import logging
+import threading
+import contextvars
+import urllib.request
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+# Name this service reports in exported spans
+SERVICE_NAME = "spleeter"
+
+# Exporter targets: a JSON-lines file and/or a Zipkin-compatible collector (e.g. http://zipkin:9411/api/v2/spans)
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE", "")
+TRACE_COLLECTOR_URL = os.getenv("TRACE_COLLECTOR_URL", "")
+TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", "2.0"))
+
+# W3C trace context header carried by requests from the backend
+TRACEPARENT_HEADER = "traceparent"
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+def _now_us() -> int:
+    return int(time.time() * 1_000_000)
+
+class Span:
+    """A single timed operation within a trace."""
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None, start_us: Optional[int] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start_us = start_us if start_us is not None else _now_us()
+        self.duration_us: Optional[int] = None
+        self.tags: Dict[str, str] = {}
+
+    def set_tag(self, key: str, value) -> None:
+        self.tags[key] = str(value)
+
+    def finish(self, end_us: Optional[int] = None) -> None:
+        self.duration_us = max(0, (end_us if end_us is not None else _now_us()) - self.start_us)
+
+    def to_zipkin(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "id": self.span_id,
+            "name": self.name,
+            "timestamp": self.start_us,
+            "duration": self.duration_us or 0,
+            "localEndpoint": {"serviceName": SERVICE_NAME},
+            "tags": self.tags
+        }
+        if self.parent_id:
+            span["parentId"] = self.parent_id
+        return span
+
+class SpanExporter:
+    """
+    Buffers finished spans and writes them from a background thread.
+    Spans are appended to TRACE_EXPORT_FILE as JSON lines and/or posted to
+    TRACE_COLLECTOR_URL in Zipkin v2 format. With neither set, spans are dropped.
+    """
+
+    def __init__(self, file_path: str = TRACE_EXPORT_FILE, collector_url: str = TRACE_COLLECTOR_URL,
+                 flush_interval: float = TRACE_FLUSH_INTERVAL):
+        self.file_path = file_path
+        self.collector_url = collector_url
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.file_path or self.collector_url)
+
+    def export(self, span: Span) -> None:
+        if not self.enabled:
+            return
+        self._queue.put(span.to_zipkin())
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                    self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch: list) -> None:
+        logger = logging.getLogger("spleeter_service")
+        if self.file_path:
+            try:
+                with open(self.file_path, "a") as f:
+                    for span in batch:
+                        f.write(json.dumps(span) + "\n")
+            except OSError as e:
+                logger.warning(f"Failed to write spans to {self.file_path}: {e}")
+        if self.collector_url:
+            request = urllib.request.Request(
+                self.collector_url,
+                data=json.dumps(batch).encode(),
+                headers={"Content-Type": "application/json"},
+                method="POST"
+            )
+            try:
+                urllib.request.urlopen(request, timeout=5).close()
+            except Exception as e:
+                logger.warning(f"Failed to send spans to {self.collector_url}: {e}")
+
+exporter = SpanExporter()
+
+def new_trace_id() -> str:
+    return secrets.token_hex(16)
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str]]:
+    """Return (trace_id, parent_span_id) from a W3C traceparent value, or None if it is malformed."""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1].lower(), parts[2].lower()
+
+@contextmanager
+def start_span(name: str, traceparent: Optional[str] = None, **tags) -> Iterator[Span]:
+    """
+    Time a block as a span. The parent is taken from an explicit traceparent
+    (e.g. an incoming header) or else the current span; without either, a new trace starts.
+    """
+    remote = parse_traceparent(traceparent)
+    parent = _current_span.get()
+    if remote:
+        trace_id, parent_id = remote
+    elif parent:
+        trace_id, parent_id = parent.trace_id, parent.span_id
+    else:
+        trace_id, parent_id = new_trace_id(), None
+
+    span = Span(name, trace_id, parent_id)
+    for key, value in tags.items():
+        span.set_tag(key, value)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.set_tag("error", str(e) or type(e).__name__)
+        raise
+    finally:
+        span.finish()
+        _current_span.reset(token)
+        exporter.export(span)
+
+def record_span(name: str, start_us: int, end_us: int, **tags) -> None:
+    """Export an already-finished operation as a child of the current span."""
+    parent = _current_span.get()
+    if parent is None:
+        return
+    span = Span(name, parent.trace_id, parent.span_id, start_us=start_us)
+    for key, value in tags.items():
+        span.set_tag(key, value)
+    span.finish(end_us)
+    exporter.export(span)